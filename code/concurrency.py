@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Helpers for pacing concurrent requests to the Gemini API, shared by findurl.py and
+update_database.py.
+"""
+import asyncio
+import random
+import statistics
+import time
+import httpx
+from collections import deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+
+class ConcurrencyController:
+    """
+    Adaptive limit on concurrent requests using AIMD (additive increase, multiplicative decrease).
+
+    After each request the limit grows by `alpha`, unless the request was rate limited or took
+    longer than the target latency (1.5x the median of recent latencies), in which case it is
+    multiplied by `beta`. The limit always stays between 1 and `max_concurrency`.
+    """
+
+    def __init__(self, initial=4, max_concurrency=16, alpha=0.5, beta=0.5):
+        self.limit = float(initial)
+        self.max_concurrency = max_concurrency
+        self.alpha = alpha
+        self.beta = beta
+        self.in_flight = 0
+        self._latencies = deque(maxlen=50)
+        self._condition = asyncio.Condition()
+
+    def target_latency(self):
+        """Returns the latency above which the API is considered congested, or None if unknown."""
+        if not self._latencies:
+            return None
+        return statistics.median(self._latencies) * 1.5
+
+    async def acquire(self):
+        """Waits until a request slot is free under the current limit and takes it."""
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self, latency, congested):
+        """Frees a request slot and adapts the limit to the outcome of the request."""
+        async with self._condition:
+            self.in_flight -= 1
+            target = self.target_latency()
+            if congested or (target is not None and latency > target):
+                self.limit = max(1.0, self.limit * self.beta)
+            else:
+                self.limit = min(self.max_concurrency, self.limit + self.alpha)
+            if not congested:
+                self._latencies.append(latency)
+            self._condition.notify_all()
+
+
+class RateLimiter:
+    """
+    Token bucket allowing at most `rate` requests per `period` seconds.
+
+    Up to `rate` requests may go out at once; after that, callers wait only as long as needed
+    for the bucket to refill, in the order they arrived.
+    """
+
+    def __init__(self, rate, period=60.0):
+        if rate <= 0 or period <= 0:
+            raise ValueError("rate and period must be positive")
+        self.rate = rate
+        self.period = period
+        self._tokens = float(rate)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Waits until a request is allowed under the rate and takes a token for it."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate / self.period)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) * self.period / self.rate)
+
+
+def is_retryable(response):
+    """Returns True if a response is a failure worth retrying: rate limited (429) or a server error (5xx)."""
+    return response.status_code == 429 or response.status_code >= 500
+
+
+def backoff_seconds(attempt, initial=1.0, maximum=30.0):
+    """
+    Returns the delay before retry number `attempt` (from 0): exponential backoff capped at
+    `maximum`, plus up to a second of random jitter so that failed requests do not retry in lockstep.
+    """
+    return min(maximum, initial * 2 ** attempt) + random.uniform(0, 1)
+
+
+async def post_with_retry(client, controller, url, headers, body, log, max_retries=5, timeout=60, limiter=None):
+    """
+    POSTs `body` to `url`, retrying rate limiting (429), server errors (5xx) and network errors.
+
+    Each attempt first takes a token from `limiter`, if given, and a slot from `controller`;
+    failed attempts count as congestion. Retries wait for the delay in the Retry-After header,
+    or back off exponentially with jitter, without holding a slot. `log` is called with a
+    message before each retry.
+
+    Returns the first response that is not worth retrying, which may still be an error for the
+    caller to handle, or None if every attempt failed transiently.
+    """
+    for attempt in range(max_retries):
+        if limiter is not None:
+            await limiter.acquire()
+        await controller.acquire()
+        started = time.monotonic()
+        congested = True
+        response = None
+        try:
+            response = await client.post(url, headers=headers, content=body, timeout=timeout)
+            congested = is_retryable(response)
+        except httpx.TransportError as e:
+            error = f"Request failed ({e!r})"
+        finally:
+            await controller.release(time.monotonic() - started, congested)
+
+        if response is not None and not is_retryable(response):
+            return response
+
+        wait_time = retry_after_seconds(response) if response is not None else None
+        if wait_time is None:
+            wait_time = backoff_seconds(attempt)
+        if response is not None:
+            error = "Rate limit hit" if response.status_code == 429 else f"Server error {response.status_code}"
+        log(f"{error}. Waiting {wait_time:.2f}s before retry {attempt + 1}/{max_retries}...")
+        await asyncio.sleep(wait_time)
+    return None
+
+
+def retry_after_seconds(response):
+    """
+    Returns the delay requested by a Retry-After header in seconds, or None if absent or invalid.
+    """
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
@@ -3,14 +3,20 @@
 This script enriches a CSV database of academic papers by finding direct PDF URLs for each entry.
 
 It uses direct HTTP requests to the Google Gemini API (gemini-2.0-flash model) to search for
-each paper based on its title, authors, and year. It includes a retry mechanism with
-exponential backoff to handle API rate limiting (429 errors).
+each paper based on its title, authors, and year. Papers are looked up in batches of BATCH_SIZE
+per request (falling back to one request per paper when a batch answer cannot be parsed), and
+requests are issued concurrently with asyncio.
+The number of requests in flight adapts to the API (additive increase, multiplicative decrease
+on 429 errors or slow responses), and rate-limited requests are retried after the delay given
+by the Retry-After header, or with exponential backoff when the header is absent.
 
 The script is RESUMABLE. If interrupted, it will continue from where it left off when run again.
+Found URLs are also kept in an on-disk cache for 30 days, so papers shared with another input
+file are not looked up again.
 
 Instructions:
 1. Make sure you have the required libraries installed:
-   pip install pandas requests tqdm
+   pip install pandas "httpx[http2]" tqdm diskcache orjson
 
 2. Set your Gemini API key as an environment variable named 'GEMINI_API_KEY'.
    - On Linux/macOS: export GEMINI_API_KEY="YOUR_KEY_HERE"
@@ -18,16 +24,20 @@ Instructions:
 
 3. Place your input CSV file at '../data/paper_database.csv' relative to this script's location.
 
-4. Run the script. It will process the papers and save progress to 'papers_with_urls.csv'
-   after each successful find.
+4. Run the script. Each successful find is appended to 'papers_with_urls.partial.csv'; when all
+   papers have been processed the results are merged and saved to 'papers_with_urls.csv'.
 """
+import asyncio
+import csv
+import hashlib
 import pandas as pd
-import requests
-import json
-import time
+import httpx
+import orjson
 import os
-import random
+import re
+from diskcache import Cache
 from tqdm import tqdm
+from concurrency import ConcurrencyController, post_with_retry
 
 # --- Configuration ---
 # Get the API key from an environment variable for better security
@@ -36,6 +46,26 @@ GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 # Input and output file paths
 INPUT_FILE_PATH = "../data/paper_database.csv"
 OUTPUT_FILE_PATH = "papers_with_urls.csv"
+# Append-only log of (index, url) pairs found since the last full save
+PARTIAL_LOG_PATH = "papers_with_urls.partial.csv"
+
+# Explicit dtypes for the text columns, so read_csv does not have to infer them
+PAPER_DTYPES = {'Title': 'string', 'Authors': 'string', 'URL': 'string'}
+
+# On-disk cache of found URLs, and how long an entry stays valid
+CACHE_DIR = ".gemini_cache"
+CACHE_EXPIRE_SECONDS = 30 * 86400
+
+# Concurrency limits for Gemini requests: the controller starts at INITIAL_CONCURRENCY
+# and adapts between 1 and MAX_CONCURRENCY requests in flight
+INITIAL_CONCURRENCY = 4
+MAX_CONCURRENCY = 16
+
+# Number of papers looked up in a single Gemini request
+BATCH_SIZE = 10
+
+# A plausible direct PDF link: http(s), no whitespace, ending in .pdf (any case), optionally with a query
+URL_RE = re.compile(r'^https?://\S+\.pdf(?:\?.*)?$', re.IGNORECASE)
 
 # Gemini API endpoint
 API_URL = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={GEMINI_API_KEY}"
@@ -55,11 +85,11 @@ def main():
     try:
         if os.path.exists(OUTPUT_FILE_PATH):
             print(f"Found existing output file '{OUTPUT_FILE_PATH}'. Resuming process.")
-            df = pd.read_csv(OUTPUT_FILE_PATH)
+            df = read_csv(OUTPUT_FILE_PATH)
         else:
             print(f"No output file found. Starting a new process from '{INPUT_FILE_PATH}'.")
-            df = pd.read_csv(INPUT_FILE_PATH)
-            df['URL'] = pd.NA # Add the URL column for the new file
+            df = read_csv(INPUT_FILE_PATH)
+            df['URL'] = pd.Series(pd.NA, index=df.index, dtype='string') # Add the URL column for the new file
     except FileNotFoundError:
         print("="*50)
         print(f"!!! ERROR: Input file not found at '{INPUT_FILE_PATH}' !!!")
@@ -70,8 +100,18 @@ def main():
         print(f"An error occurred while reading the CSV file: {e}")
         return
 
+    # Apply URLs found by an interrupted run that were not merged yet
+    apply_partial_log(df)
+
     # --- Process Papers ---
-    process_papers(df)
+    asyncio.run(process_papers(df))
+
+    # Merge everything into the output file once, then drop the partial log.
+    # Writing to a temporary file first means a crash never leaves a truncated output.
+    df.to_csv(OUTPUT_FILE_PATH + '.tmp', index=False)
+    os.replace(OUTPUT_FILE_PATH + '.tmp', OUTPUT_FILE_PATH)
+    if os.path.exists(PARTIAL_LOG_PATH):
+        os.remove(PARTIAL_LOG_PATH)
     
     print("\n" + "="*50)
     print(f"Processing complete!")
@@ -79,38 +119,178 @@ def main():
     print("="*50)
     
     # Display the first few rows of the final dataframe
-    final_df = pd.read_csv(OUTPUT_FILE_PATH)
+    final_df = read_csv(OUTPUT_FILE_PATH)
     print("\nPreview of the final data:")
     print(final_df.head())
 
 
-def process_papers(df):
+def read_csv(path):
+    """
+    Reads a paper CSV with the pyarrow engine if it is installed, falling back to the C engine.
+    """
+    try:
+        return pd.read_csv(path, dtype=PAPER_DTYPES, engine='pyarrow')
+    except ImportError:
+        return pd.read_csv(path, dtype=PAPER_DTYPES)
+
+
+def apply_partial_log(df):
+    """
+    Applies the (index, url) pairs recorded in the partial log to the DataFrame.
+
+    Rows that are not a valid pair, such as a last line cut short by an interrupted run,
+    are skipped with a warning.
+    """
+    if not os.path.exists(PARTIAL_LOG_PATH):
+        return
+    entries = []
+    with open(PARTIAL_LOG_PATH, newline='') as log:
+        for line_number, row in enumerate(csv.reader(log), start=1):
+            try:
+                index, url = row
+                index = int(index)
+            except ValueError:
+                print(f"Warning: Skipping malformed line {line_number} in '{PARTIAL_LOG_PATH}': {row}")
+                continue
+            if not 0 <= index < len(df):
+                print(f"Warning: Skipping line {line_number} in '{PARTIAL_LOG_PATH}': row {index} is not in the data")
+                continue
+            entries.append((index, url))
+    print(f"Found {len(entries)} unsaved URLs in '{PARTIAL_LOG_PATH}'. Applying them.")
+    url_col_idx = df.columns.get_loc('URL')
+    for index, url in entries:
+        df.iat[index, url_col_idx] = url
+
+
+async def process_papers(df):
     """
-    Iterates through the DataFrame, finds missing PDF URLs, and saves after each addition.
+    Finds missing PDF URLs concurrently and logs each addition to the partial log.
+
+    Missing papers are split into batches of BATCH_SIZE, each looked up by an asyncio task.
+    The tasks share one HTTP client, with the number of requests in flight governed by a
+    ConcurrencyController. Completed (index, url) pairs are pushed onto
+    a queue and applied to the DataFrame by a single checkpoint writer, so the log is never
+    written concurrently.
     """
     print("Starting to process papers to find missing PDF URLs...")
-    
+
+    # Select the rows whose URL is missing (NaN, None, etc.) in one vectorized pass
+    missing_mask = df['URL'].isna()
+    missing = list(df.loc[missing_mask, ['Title', 'Authors', 'Year']].itertuples(index=True, name=None))
+
+    controller = ConcurrencyController(initial=INITIAL_CONCURRENCY, max_concurrency=MAX_CONCURRENCY)
+    completed = asyncio.Queue()
+    # HTTP/2 multiplexes the concurrent requests over a few long-lived connections
+    limits = httpx.Limits(max_connections=10, max_keepalive_connections=10, keepalive_expiry=300)
+
     # Using tqdm for a nice progress bar
-    for index, row in tqdm(df.iterrows(), total=df.shape[0], desc="Finding PDFs"):
-        # Check if URL is missing (NaN, None, etc.)
-        if pd.isna(row.get('URL')):
-            url = get_pdf_url_with_retry(row['Title'], row['Authors'], row['Year'])
-            
-            # Update the DataFrame and save progress immediately
+    with tqdm(total=len(missing), desc="Finding PDFs") as progress, Cache(CACHE_DIR) as cache:
+        async with httpx.AsyncClient(http2=True, limits=limits) as client:
+            writer = asyncio.create_task(write_checkpoints(df, completed, progress))
+
+            async def find_urls(batch):
+                urls = await get_pdf_urls_batch(client, controller, cache, [paper[1:] for paper in batch])
+                for (index, *_), url in zip(batch, urls):
+                    await completed.put((index, url))
+
+            batches = [missing[i:i + BATCH_SIZE] for i in range(0, len(missing), BATCH_SIZE)]
+            await asyncio.gather(*(find_urls(batch) for batch in batches))
+            await completed.put(None)  # Tell the writer no more results are coming
+            await writer
+
+
+async def write_checkpoints(df, completed, progress):
+    """
+    Consumes (index, url) pairs from the queue, updates the DataFrame and logs progress.
+    """
+    # The DataFrame comes straight from read_csv, so index labels are row positions
+    url_col_idx = df.columns.get_loc('URL')
+    # Line buffered, so every find is on disk as soon as it is written
+    with open(PARTIAL_LOG_PATH, 'a', buffering=1, newline='') as progress_log:
+        log_writer = csv.writer(progress_log)
+        while True:
+            item = await completed.get()
+            if item is None:
+                break
+            index, url = item
+
+            # Update the DataFrame and append the find to the log immediately
             if url != "NA":
-                df.loc[index, 'URL'] = url
-                # Save the entire dataframe after each successful find
-                df.to_csv(OUTPUT_FILE_PATH, index=False)
-            
-            # A small delay to be respectful to the API and avoid rate limiting
-            time.sleep(1.5)
+                df.iat[index, url_col_idx] = url
+                log_writer.writerow([index, url])
+            progress.update(1)
+
+
+def url_cache_key(paper_title, authors, year):
+    """Returns the cache key for a paper's URL."""
+    return hashlib.blake2b(f"{paper_title}|{authors}|{year}".encode(), digest_size=16).hexdigest()
 
 
-def get_pdf_url_with_retry(paper_title, authors, year):
+def is_pdf_url(url):
+    """Checks whether a model answer is a plausible direct PDF URL."""
+    return URL_RE.match(url) is not None
+
+
+async def generate_text_with_retry(client, controller, payload, description):
     """
-    Queries the Gemini model with a retry mechanism to handle rate limiting.
+    Sends a request to the Gemini model, retrying rate limiting, server errors and network errors.
 
     Args:
+        client (httpx.AsyncClient): The shared HTTP client.
+        controller (ConcurrencyController): Bounds the number of requests in flight.
+        payload (dict): The request payload.
+        description (str): What is being looked up, used in log messages.
+
+    Returns:
+        str: The stripped text of the model's answer ('' if it had none), or None if the
+        request failed.
+    """
+    headers = {"Content-Type": "application/json"}
+    body = orjson.dumps(payload)  # Serialized once and reused by every retry
+    
+    max_retries = 5
+    try:
+        # Rate limiting, server errors and network errors are retried by post_with_retry
+        response = await post_with_retry(client, controller, API_URL, headers, body,
+                                         lambda message: tqdm.write(f"{description}: {message}"),
+                                         max_retries=max_retries, timeout=60)
+        if response is None:
+            tqdm.write(f"Failed to process {description} after {max_retries} attempts due to persistent rate limiting or errors.")
+            return None
+
+        response.raise_for_status()  # Raise an exception for other bad status codes (4xx)
+        
+        result = orjson.loads(response.content)
+        
+        # Safely extract the text from the response
+        if 'candidates' in result and len(result['candidates']) > 0:
+            content = result['candidates'][0].get('content', {})
+            if 'parts' in content and len(content['parts']) > 0:
+                return content['parts'][0].get('text', '').strip()
+        
+        # No content in the response
+        return ""
+        
+    except httpx.HTTPError as e:
+        # Handle potential network or HTTP errors
+        tqdm.write(f"API request error for {description}: {e}")
+        return None # Exit on errors that are not worth retrying (4xx)
+    except Exception as e:
+        # Handle other unexpected errors (e.g., JSON parsing)
+        tqdm.write(f"Unexpected error for {description}: {e}")
+        return None
+
+
+async def get_pdf_url_with_retry(client, controller, cache, paper_title, authors, year):
+    """
+    Queries the Gemini model for the PDF URL of a single paper.
+
+    URLs found earlier are answered from the cache without calling the API.
+
+    Args:
+        client (httpx.AsyncClient): The shared HTTP client.
+        controller (ConcurrencyController): Bounds the number of requests in flight.
+        cache (diskcache.Cache): On-disk cache of found URLs.
         paper_title (str): The title of the paper.
         authors (str): The authors of the paper.
         year (int): The publication year.
@@ -118,6 +298,11 @@ def get_pdf_url_with_retry(paper_title, authors, year):
     Returns:
         str: The found URL or 'NA' if not found or an error occurs.
     """
+    cache_key = url_cache_key(paper_title, authors, year)
+    cached_url = cache.get(cache_key)
+    if cached_url is not None:
+        return cached_url
+
     # Construct a very specific prompt for the model
     prompt = (
         f"Find a direct, publicly accessible PDF URL for the academic paper titled "
@@ -125,55 +310,81 @@ def get_pdf_url_with_retry(paper_title, authors, year):
         f"Prioritize links from university repositories, arXiv, or official publisher sites. "
         f"Respond with only the full URL. If no direct PDF link can be found, respond with exactly 'NA'."
     )
-    
-    headers = {"Content-Type": "application/json"}
     payload = {
         "contents": [{"parts": [{"text": prompt}]}]
     }
-    
-    max_retries = 5
-    for attempt in range(max_retries):
-        try:
-            # Make the POST request to the Gemini API
-            response = requests.post(API_URL, headers=headers, json=payload, timeout=60)
-            
-            # Check for rate limit error (429)
-            if response.status_code == 429:
-                wait_time = (2 ** attempt) + random.uniform(0, 1)
-                tqdm.write(f"Rate limit hit for '{paper_title}'. Waiting {wait_time:.2f}s before retry {attempt + 1}/{max_retries}...")
-                time.sleep(wait_time)
-                continue  # Try the request again
-
-            response.raise_for_status()  # Raise an exception for other bad status codes (4xx or 5xx)
-            
-            result = response.json()
-            
-            # Safely extract the text from the response
-            if 'candidates' in result and len(result['candidates']) > 0:
-                content = result['candidates'][0].get('content', {})
-                if 'parts' in content and len(content['parts']) > 0:
-                    url = content['parts'][0].get('text', '').strip()
-                    # Validate if the response is a plausible URL
-                    if url.startswith("http") and url.lower().endswith(".pdf"):
-                        return url
-            
-            # If parsing fails, validation fails, or no content, return NA
-            return "NA"
-            
-        except requests.exceptions.RequestException as e:
-            # Handle potential network or HTTP errors
-            tqdm.write(f"API request error for '{paper_title}': {e}")
-            return "NA" # Exit on non-rate-limit errors
-        except Exception as e:
-            # Handle other unexpected errors (e.g., JSON parsing)
-            tqdm.write(f"Unexpected error for '{paper_title}': {e}")
-            return "NA"
-
-    # If all retries fail
-    tqdm.write(f"Failed to process '{paper_title}' after {max_retries} attempts due to persistent rate limiting.")
+
+    url = await generate_text_with_retry(client, controller, payload, f"'{paper_title}'")
+    # Validate if the response is a plausible URL
+    if url and is_pdf_url(url):
+        cache.set(cache_key, url, expire=CACHE_EXPIRE_SECONDS)
+        return url
     return "NA"
 
 
+async def get_pdf_urls_batch(client, controller, cache, papers):
+    """
+    Queries the Gemini model for the PDF URLs of several papers in a single request.
+
+    Papers whose URL is cached are not sent. If the model's answer cannot be parsed, or
+    leaves a paper out, those papers are looked up one at a time instead.
+
+    Args:
+        client (httpx.AsyncClient): The shared HTTP client.
+        controller (ConcurrencyController): Bounds the number of requests in flight.
+        cache (diskcache.Cache): On-disk cache of found URLs.
+        papers (list): (title, authors, year) tuples.
+
+    Returns:
+        list: The found URL or 'NA' for each paper, in the same order.
+    """
+    urls = [cache.get(url_cache_key(*paper)) for paper in papers]
+    pending = [i for i, url in enumerate(urls) if url is None]
+
+    if len(pending) > 1:
+        # Number the papers so answers can be matched exactly, whatever happens to the titles
+        paper_list = "\n".join(
+            f"{n}. '{papers[i][0]}' by {papers[i][1]} ({papers[i][2]})" for n, i in enumerate(pending, start=1)
+        )
+        prompt = (
+            f"Find a direct, publicly accessible PDF URL for each of the following academic papers.\n"
+            f"{paper_list}\n"
+            f"Prioritize links from university repositories, arXiv, or official publisher sites. "
+            f"Return a JSON object mapping each paper's number (as a string) to its full PDF URL, "
+            f"or to exactly 'NA' if no direct PDF link can be found."
+        )
+        payload = {
+            "contents": [{"parts": [{"text": prompt}]}],
+            "generationConfig": {"response_mime_type": "application/json"}
+        }
+
+        text = await generate_text_with_retry(client, controller, payload, f"a batch of {len(pending)} papers")
+        if text is None:
+            # The request itself failed; retrying paper by paper would only add load
+            return [url if url is not None else "NA" for url in urls]
+
+        try:
+            answers = orjson.loads(text)
+        except orjson.JSONDecodeError:
+            answers = None
+        if isinstance(answers, dict):
+            for n, i in enumerate(pending, start=1):
+                url = str(answers.get(str(n), "")).strip()
+                if is_pdf_url(url):
+                    cache.set(url_cache_key(*papers[i]), url, expire=CACHE_EXPIRE_SECONDS)
+                    urls[i] = url
+                elif url == "NA":
+                    urls[i] = "NA"
+        else:
+            tqdm.write(f"Could not parse the answer for a batch of {len(pending)} papers. Looking them up one at a time.")
+
+    # Anything still unanswered is looked up on its own
+    for i, url in enumerate(urls):
+        if url is None:
+            urls[i] = await get_pdf_url_with_retry(client, controller, cache, *papers[i])
+    return urls
+
+
 # --- Execution ---
 if __name__ == "__main__":
     main()
@@ -3,18 +3,35 @@
 This script analyzes research paper PDFs using the Gemini API to automatically
 populate a relational database that represents the structure of a scientific field.
 
-It reads a list of PDF file paths from standard input, and for each PDF, it:
+It reads a list of PDF file paths from standard input and processes up to
+MAX_CONCURRENT_PDFS of them at a time. For each PDF, it:
 1.  Performs a full analysis using the Gemini API.
 2.  Generates a CitationKey from the returned bibliographic data.
 3.  Checks if this CitationKey already exists in the database.
 4.  If the paper is new, it appends the new, non-duplicate information to the
-    database CSV files. If the paper already exists, it does nothing.
+    in-memory database. If the paper already exists, it does nothing.
+
+The database files are loaded once, and written back every --flush-every new
+papers (default 10) and when the script exits. Paths ending in .parquet are read
+and written as zstd-compressed Parquet (requires pyarrow), which is much faster
+than CSV; --migrate-to-parquet writes a Parquet copy of existing CSV files.
+concart.jl reads the CSV files, so keep those as the source for the TUI.
+
+With --batch, all PDFs that are not cached are instead submitted as a single Gemini
+Batch Mode job, which costs half as much and is not rate limited per call, at the
+price of waiting (up to 24 hours) for the job to complete.
 
 This script is designed to be idempotent. Running it twice with the same
-input will not create duplicate entries in the database.
+input will not create duplicate entries in the database. Successful analyses
+are kept in an on-disk cache keyed by the PDF contents, so re-running over the
+same PDFs does not call the API again (use --no-cache to always call it).
+With --cache-prompt, the prompt (which lists every known object and morphism) is
+rendered once per run, stored once with Gemini's context caching instead of being
+sent with every PDF, and deleted from the API when the run ends.
 
 Prerequisites:
-- pandas, requests, tqdm
+- pandas, httpx[http2], diskcache, orjson
+- Optional: pyarrow (faster CSV reading, and Parquet support), PyMuPDF (for --text-only)
 - A GEMINI_API_KEY environment variable.
 
 Usage:
@@ -22,21 +39,101 @@ ls path/to/papers/*.pdf | python this_script.py \
     --papers ../data/papers.csv \
     --objects ../data/c_objects.csv \
     --morphisms ../data/c_morphisms.csv \
-    --evidence ../data/c_evidence.csv
+    --evidence ../data/c_evidence.csv \
+    [--batch]
 """
 import os
 import sys
+import asyncio
+import atexit
 import argparse
 import base64
-import requests
+import concurrent.futures
+import gzip
+import hashlib
+import httpx
 import json
+import orjson
 import pandas as pd
 import time
 import re
-from typing import List, Optional, Dict, Any
+import tempfile
+from diskcache import Cache
+try:
+    import pyarrow as pa
+except ImportError:  # pyarrow is optional; pandas' own CSV reader is used without it
+    pa = None
+try:
+    import pymupdf
+except ImportError:  # PyMuPDF is optional; it is only needed for --text-only
+    pymupdf = None
+from typing import List, Optional, Dict, Any, Set
+from concurrency import ConcurrencyController, RateLimiter, backoff_seconds, is_retryable, post_with_retry
 
 # --- Configuration ---
+GEMINI_API_BASE = "https://generativelanguage.googleapis.com"
+GEMINI_MODEL = "gemini-2.0-flash"
 API_TIMEOUT = 5 * 60  # 5 minutes
+# Seconds between status checks of a Batch Mode job
+BATCH_POLL_INTERVAL = 30
+# States in which a Batch Mode job has finished; any other (or no) state means it is still going
+BATCH_END_STATES = ('BATCH_STATE_SUCCEEDED', 'BATCH_STATE_FAILED', 'BATCH_STATE_CANCELLED', 'BATCH_STATE_EXPIRED')
+# Limits analysis requests to the --rpm requests per minute allowed by the API quota, if given
+RATE_LIMITER: Optional[RateLimiter] = None
+# Attempts per API call while it keeps failing transiently: rate limited (429), server errors (5xx) or network errors
+MAX_RETRIES = 5
+# PDFs analyzed at the same time; also the most API requests in flight
+MAX_CONCURRENT_PDFS = 4
+# PDFs read and encoded ahead of time while waiting for one of those slots; bounds the extra memory held
+PREFETCH_PDFS = 4
+# PDFs are base64 encoded in chunks of this size; a multiple of 3 so chunks encode without padding
+PDF_READ_CHUNK_SIZE = 3 * 64 * 1024
+# The Batch Mode input file is uploaded from disk in chunks of this size
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Request bodies at least this large are sent gzip-compressed. Turned off for the rest of
+# the run if the API rejects a compressed request but accepts the same request uncompressed.
+GZIP_MIN_SIZE = 64 * 1024
+GZIP_REQUESTS = True
+
+# Explicit dtypes for the database tables, so read_csv does not have to infer them
+DTYPES = {
+    'papers': {'CitationKey': 'string', 'Authors': 'string', 'Title': 'string', 'Publication': 'string',
+               'TheoryCategory': 'string', 'MethodCategory': 'string', 'Phenomenon': 'string', 'URL': 'string'},
+    'objects': {'ObjectID': 'string', 'Name': 'string', 'Type': 'string', 'Description': 'string'},
+    'morphisms': {'MorphismID': 'string', 'Label': 'string', 'SourceType': 'string', 'TargetType': 'string', 'Description': 'string'},
+    'evidence': {'EvidenceID': 'Int64', 'CitationKey': 'string', 'SourceID': 'string', 'MorphismID': 'string',
+                 'TargetID': 'string', 'Notes': 'string'},
+}
+
+# On-disk cache of analysis results. Bump PROMPT_VERSION when the prompt changes
+# so that results produced by an older prompt are no longer used.
+CACHE_DIR = ".gemini_cache"
+PROMPT_VERSION = "1"
+
+# Shared analysis cache, opened on first use (see get_cache). Turned off with --no-cache.
+CACHE: Optional[Cache] = None
+CACHE_ENABLED = True
+
+# With --text-only, the PDF's text is extracted locally and sent instead of the PDF itself.
+# Extraction is CPU bound, so it runs in a process pool, created on first use (see get_process_pool).
+TEXT_ONLY = False
+PROCESS_POOL: Optional[concurrent.futures.ProcessPoolExecutor] = None
+
+# Characters stripped from the author name in a CitationKey
+NON_ALNUM = re.compile(r'\W+')
+
+# With --cache-prompt, the run's prompt is stored once with Gemini's context caching
+# and referenced by name, so it is not re-sent and re-tokenized with every PDF.
+# Maps a hash of the prompt to the task creating its cache and the time it must be renewed.
+CONTEXT_CACHING = False
+CONTEXT_CACHE_TTL = 60 * 60  # 1 hour
+_CONTEXT_CACHES: Dict[str, tuple] = {}
+
+# Analyses currently running, keyed like the cache, so concurrent requests for the same PDF share one API call
+_IN_FLIGHT: Dict[str, "asyncio.Task"] = {}
+
+# Last rendered prompt, keyed by a fingerprint of the objects and morphisms it lists
+_PROMPT_CACHE: Dict[tuple, str] = {}
 
 # --- Helper Functions ---
 
@@ -48,11 +145,66 @@ def get_gemini_api_key() -> str:
         sys.exit(1)
     return api_key
 
+def is_parquet(path: str) -> bool:
+    return path.lower().endswith('.parquet')
+
+def read_table(path: str, dtype: Dict[str, str]) -> pd.DataFrame:
+    """Read a database table from Parquet or CSV, the latter with the pyarrow engine if installed.
+
+    Columns in `dtype` that the file does not have are ignored, as read_csv does.
+    """
+    if is_parquet(path):
+        df = pd.read_parquet(path)
+        return df.astype({column: t for column, t in dtype.items() if column in df.columns})
+    return pd.read_csv(path, dtype=dtype, engine='pyarrow' if pa is not None else 'c')
+
+def write_table(df: pd.DataFrame, path: str):
+    """Write a database table to Parquet or CSV.
+
+    CSV is written by pandas, which quotes only where needed and so keeps the diffs of the
+    git-tracked data files to the rows that actually changed.
+
+    The table is written to a temporary file that then replaces the old one, so a crash
+    while writing leaves the previous version intact.
+    """
+    tmp_path = path + '.tmp'
+    try:
+        if is_parquet(path):
+            # Columns holding rows merged from the model have object dtype and may mix types
+            # (e.g. a number where a name was expected), which Parquet cannot store
+            mixed = df.columns[df.dtypes == object]
+            df.astype({column: 'string' for column in mixed}).to_parquet(tmp_path, index=False, compression='zstd')
+        else:
+            df.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def get_cache() -> Cache:
+    """Return the shared analysis cache, opening it on first use."""
+    global CACHE
+    if CACHE is None:
+        CACHE = Cache(CACHE_DIR)
+    return CACHE
+
+def cached_analysis(key: str) -> Optional[Dict[str, Any]]:
+    """Return the cached analysis for the key, or None if there is none or caching is off."""
+    return get_cache().get(key) if CACHE_ENABLED else None
+
+def store_analysis(key: str, result: Dict[str, Any]):
+    """Cache an analysis result, unless caching is off."""
+    if CACHE_ENABLED:
+        get_cache().set(key, result)
+
 def pdf_to_base64(pdf_path: str) -> Optional[str]:
-    """Convert a PDF file to a base64 encoded string."""
+    """Convert a PDF file to a base64 encoded string, reading it in chunks to bound peak memory."""
     try:
+        encoded_chunks = []
         with open(pdf_path, 'rb') as pdf_file:
-            return base64.b64encode(pdf_file.read()).decode('utf-8')
+            while chunk := pdf_file.read(PDF_READ_CHUNK_SIZE):
+                encoded_chunks.append(base64.b64encode(chunk).decode('ascii'))
+        return "".join(encoded_chunks)
     except FileNotFoundError:
         print(f"Error: PDF file not found at '{pdf_path}'", file=sys.stderr)
         return None
@@ -60,29 +212,99 @@ def pdf_to_base64(pdf_path: str) -> Optional[str]:
         print(f"Error reading or encoding PDF '{pdf_path}': {e}", file=sys.stderr)
         return None
 
+def extract_pdf_text(pdf_path: str) -> Optional[str]:
+    """Extract the text of every page of a PDF with PyMuPDF."""
+    try:
+        with pymupdf.open(pdf_path) as document:
+            return "\n".join(page.get_text() for page in document)
+    except FileNotFoundError:
+        print(f"Error: PDF file not found at '{pdf_path}'", file=sys.stderr)
+        return None
+    except Exception as e:
+        print(f"Error extracting text from PDF '{pdf_path}': {e}", file=sys.stderr)
+        return None
+
+def get_process_pool() -> concurrent.futures.ProcessPoolExecutor:
+    """Return the shared process pool for text extraction, starting it on first use."""
+    global PROCESS_POOL
+    if PROCESS_POOL is None:
+        PROCESS_POOL = concurrent.futures.ProcessPoolExecutor()
+    return PROCESS_POOL
+
+async def read_pdf(pdf_path: str) -> Optional[str]:
+    """Return what is sent to Gemini for a PDF: its text with --text-only, otherwise the base64 encoded file.
+
+    Neither blocks the event loop. Text extraction runs in the process pool so that several PDFs
+    use several cores; base64 encoding is mostly file I/O and runs in a thread, as copying the
+    encoded file back from another process would cost about as much as encoding it.
+    """
+    if TEXT_ONLY:
+        return await asyncio.get_running_loop().run_in_executor(get_process_pool(), extract_pdf_text, pdf_path)
+    return await asyncio.to_thread(pdf_to_base64, pdf_path)
+
 def create_citation_key(authors: str, year: int) -> str:
     """Creates a unique CitationKey (e.g., 'Author2023')."""
     if not authors or not year:
         return None
-    first_author_last_name = authors.split(',')[0].strip().split(' ')[-1]
-    first_author_last_name = re.sub(r'\W+', '', first_author_last_name)
+    first_author_last_name = authors.partition(',')[0].strip().rpartition(' ')[2]
+    first_author_last_name = NON_ALNUM.sub('', first_author_last_name)
     return f"{first_author_last_name}{year}"
 
-def call_gemini_api(payload: Dict[str, Any], api_key: str) -> Optional[Dict[str, Any]]:
-    """Generic function to call the Gemini API and handle responses."""
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={api_key}"
+def strip_json_fence(text: str) -> str:
+    """Removes the ```json ... ``` markdown fence Gemini wraps around JSON output."""
+    text = text.strip()
+    if text.startswith('```'):
+        text = text.removeprefix('```json').removeprefix('```').removesuffix('```')
+    return text.strip()
+
+def parse_analysis_text(result_text: str) -> Dict[str, Any]:
+    """Parse the JSON object in a model answer, raising a json.JSONDecodeError if it is not valid JSON."""
+    return orjson.loads(strip_json_fence(result_text))
+
+async def call_gemini_api(client: httpx.AsyncClient, controller: ConcurrencyController, payload: Dict[str, Any], api_key: str) -> Optional[Dict[str, Any]]:
+    """Generic function to call the Gemini API and handle responses.
+
+    Rate-limited requests, server errors and network errors are retried after the delay in
+    the Retry-After header, or with exponential backoff and jitter when it is absent.
+    """
+    global GZIP_REQUESTS
+    url = f"{GEMINI_API_BASE}/v1beta/models/{GEMINI_MODEL}:generateContent?key={api_key}"
     headers = {"Content-Type": "application/json"}
-    
+    body = orjson.dumps(payload)
+    if GZIP_REQUESTS and len(body) >= GZIP_MIN_SIZE:
+        # zlib releases the GIL, so compressing a large PDF does not stall the event loop
+        body = await asyncio.to_thread(gzip.compress, body, 6)
+        headers["Content-Encoding"] = "gzip"
+    result_text = None
+
+    def log(message: str):
+        print(message, file=sys.stderr)
+
+    async def post(body: bytes) -> Optional[httpx.Response]:
+        return await post_with_retry(client, controller, url, headers, body, log,
+                                     max_retries=MAX_RETRIES, timeout=API_TIMEOUT, limiter=RATE_LIMITER)
+
     try:
-        response = requests.post(url, headers=headers, json=payload, timeout=API_TIMEOUT)
+        response = await post(body)
+
+        if response is not None and response.status_code in (400, 415) and "Content-Encoding" in headers:
+            # A 400 may well be about the PDF rather than the compression, so resend it
+            # uncompressed once and only give up on gzip if that succeeds
+            del headers["Content-Encoding"]
+            response = await post(orjson.dumps(payload))
+            if response is not None and response.is_success and GZIP_REQUESTS:
+                print("Warning: The API rejected a gzip-compressed request. Sending uncompressed requests from now on.", file=sys.stderr)
+                GZIP_REQUESTS = False
+
+        if response is None:
+            print(f"Error calling Gemini API: still failing after {MAX_RETRIES} attempts", file=sys.stderr)
+            return None
+
         response.raise_for_status()
-        
-        result_text = response.json()['candidates'][0]['content']['parts'][0]['text']
-        cleaned_text = re.sub(r'```json\n?|```', '', result_text).strip()
-        
-        return json.loads(cleaned_text)
-        
-    except requests.exceptions.RequestException as e:
+        result_text = orjson.loads(response.content)['candidates'][0]['content']['parts'][0]['text']
+        return parse_analysis_text(result_text)
+
+    except httpx.HTTPError as e:
         print(f"Error calling Gemini API: {e}", file=sys.stderr)
     except (json.JSONDecodeError, KeyError, IndexError) as e:
         print(f"Error parsing JSON response: {e}", file=sys.stderr)
@@ -94,10 +316,24 @@ def call_gemini_api(payload: Dict[str, Any], api_key: str) -> Optional[Dict[str,
 
 # --- Core Gemini and Database Logic ---
 
-def get_full_analysis(pdf_base64: str, existing_objects_df: pd.DataFrame, existing_morphisms_df: pd.DataFrame, api_key: str) -> Optional[Dict[str, Any]]:
-    """Performs the full, detailed analysis of the PDF."""
-    existing_objects_str = "\n".join([f"- {row['ObjectID']}: {row['Name']}" for _, row in existing_objects_df.iterrows()])
-    existing_morphisms_str = "\n".join([f"- {row['MorphismID']}: Connects '{row['SourceType']}' to '{row['TargetType']}' (Label: {row['Label']})" for _, row in existing_morphisms_df.iterrows()])
+def _frame_fingerprint(df: pd.DataFrame, columns: List[str]) -> tuple:
+    """Cheap identity of the given columns of a DataFrame, used as a cache key."""
+    hashes = pd.util.hash_pandas_object(df[columns], index=False)
+    return (len(df), hash(hashes.values.tobytes()))
+
+def build_prompt(existing_objects_df: pd.DataFrame, existing_morphisms_df: pd.DataFrame) -> str:
+    """Renders the analysis prompt, reusing the last one if the objects and morphisms are unchanged."""
+    key = (_frame_fingerprint(existing_objects_df, ['ObjectID', 'Name']),
+           _frame_fingerprint(existing_morphisms_df, ['MorphismID', 'SourceType', 'TargetType', 'Label']))
+    if key in _PROMPT_CACHE:
+        return _PROMPT_CACHE[key]
+
+    # Render with pandas string ops; missing values become empty strings so no row is dropped
+    objects = existing_objects_df[['ObjectID', 'Name']].astype(str).fillna('')
+    existing_objects_str = ("- " + objects['ObjectID'] + ": " + objects['Name']).str.cat(sep="\n")
+    morphisms = existing_morphisms_df[['MorphismID', 'SourceType', 'TargetType', 'Label']].astype(str).fillna('')
+    existing_morphisms_str = ("- " + morphisms['MorphismID'] + ": Connects '" + morphisms['SourceType']
+                              + "' to '" + morphisms['TargetType'] + "' (Label: " + morphisms['Label'] + ")").str.cat(sep="\n")
     json_schema = """
     {
       "bibliographic": {"authors": "Full list of authors", "year": 2024, "title": "Full title", "publication": "Journal name"},
@@ -130,125 +366,488 @@ You are an expert academic research assistant. Your task is to analyze a researc
 ---
 Now, analyze the attached PDF and generate the complete JSON object.
 """
-    payload = {
-        "contents": [{"parts": [{"text": prompt}, {"inline_data": {"mime_type": "application/pdf", "data": pdf_base64}}]}],
-        "generationConfig": { "temperature": 0.2, "maxOutputTokens": 8192 }
+    _PROMPT_CACHE.clear()
+    _PROMPT_CACHE[key] = prompt
+    return prompt
+
+def build_analysis_payload(prompt: str, pdf_content: str, cached_content: Optional[str] = None) -> Dict[str, Any]:
+    """Builds the generateContent request body for analyzing one PDF, given as returned by read_pdf.
+
+    If `cached_content` names a context cache holding the prompt, the prompt itself is left out.
+    """
+    if TEXT_ONLY:
+        pdf_part = {"text": f"PAPER:\n{pdf_content}"}
+    else:
+        pdf_part = {"inline_data": {"mime_type": "application/pdf", "data": pdf_content}}
+    generation_config = { "temperature": 0.2, "maxOutputTokens": 8192 }
+    if cached_content:
+        return {"cachedContent": cached_content, "contents": [{"role": "user", "parts": [pdf_part]}],
+                "generationConfig": generation_config}
+    return {
+        "contents": [{"parts": [{"text": prompt}, pdf_part]}],
+        "generationConfig": generation_config
     }
-    return call_gemini_api(payload, api_key)
 
+async def create_context_cache(client: httpx.AsyncClient, prompt: str, api_key: str) -> Optional[str]:
+    """Stores the prompt with Gemini's context caching and returns the cache's name.
+
+    Returns None, and turns context caching off for the rest of the run, if the cache cannot
+    be created (for instance when the prompt is shorter than the model's minimum).
+    """
+    global CONTEXT_CACHING
+    body = {
+        "model": f"models/{GEMINI_MODEL}",
+        "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+        "ttl": f"{CONTEXT_CACHE_TTL}s",
+    }
+    try:
+        response = await client.post(f"{GEMINI_API_BASE}/v1beta/cachedContents?key={api_key}",
+                                     headers={"Content-Type": "application/json"}, content=orjson.dumps(body),
+                                     timeout=API_TIMEOUT)
+        response.raise_for_status()
+        return orjson.loads(response.content)['name']
+    except (httpx.HTTPError, KeyError) as e:
+        print(f"Warning: Could not cache the prompt, sending it with every request instead: {e}", file=sys.stderr)
+        CONTEXT_CACHING = False
+        return None
+
+async def get_context_cache(client: httpx.AsyncClient, prompt: str, api_key: str) -> Optional[str]:
+    """Returns the name of a live context cache holding the prompt, creating one if needed."""
+    key = hashlib.blake2b(prompt.encode('utf-8'), digest_size=16).hexdigest()
+    entry = _CONTEXT_CACHES.get(key)
+    # Renew a minute before expiry so requests in flight do not reference an expired cache
+    if entry is None or time.monotonic() > entry[1]:
+        entry = (asyncio.ensure_future(create_context_cache(client, prompt, api_key)),
+                 time.monotonic() + CONTEXT_CACHE_TTL - 60)
+        _CONTEXT_CACHES[key] = entry
+    return await asyncio.shield(entry[0])
+
+async def delete_context_caches(client: httpx.AsyncClient, api_key: str):
+    """Deletes the context caches created by this run, so they stop accruing storage costs."""
+    for task, _ in _CONTEXT_CACHES.values():
+        name = task.result() if task.done() and not task.cancelled() else None
+        if name is None:
+            continue
+        try:
+            response = await client.delete(f"{GEMINI_API_BASE}/v1beta/{name}?key={api_key}", timeout=API_TIMEOUT)
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            print(f"Warning: Could not delete context cache '{name}'; it expires on its own: {e}", file=sys.stderr)
+    _CONTEXT_CACHES.clear()
+
+def analysis_key(pdf_path: str) -> Optional[str]:
+    """Idempotency key of an analysis: identifies the PDF file's bytes, the prompt version and whether only text was sent.
+
+    The file is hashed as it is read, so a cached analysis is found without encoding the PDF
+    or extracting its text.
+    """
+    hasher = hashlib.blake2b(digest_size=16)
+    try:
+        with open(pdf_path, 'rb') as pdf_file:
+            while chunk := pdf_file.read(PDF_READ_CHUNK_SIZE):
+                hasher.update(chunk)
+    except OSError as e:
+        print(f"Error reading PDF '{pdf_path}': {e}", file=sys.stderr)
+        return None
+    hasher.update(PROMPT_VERSION.encode('ascii'))
+    if TEXT_ONLY:
+        hasher.update(b':text')
+    return f"analysis:{hasher.hexdigest()}"
+
+async def get_full_analysis(client: httpx.AsyncClient, controller: ConcurrencyController, key: str, pdf_content: str,
+                            prompt: str, api_key: str) -> Optional[Dict[str, Any]]:
+    """Performs the full, detailed analysis of the PDF, whose analysis_key is `key`, with the given prompt.
+
+    Each PDF is analyzed at most once: a cached result is reused, and a caller asking for a PDF
+    that is already being analyzed waits for that request instead of sending another.
+    """
+    cached = cached_analysis(key)
+    if cached is not None:
+        print("  - Using cached analysis.")
+        return cached
+
+    async def analyze() -> Optional[Dict[str, Any]]:
+        cached_content = await get_context_cache(client, prompt, api_key) if CONTEXT_CACHING else None
+        payload = build_analysis_payload(prompt, pdf_content, cached_content)
+        return await call_gemini_api(client, controller, payload, api_key)
+
+    task = _IN_FLIGHT.get(key)
+    if task is None:
+        task = asyncio.ensure_future(analyze())
+        _IN_FLIGHT[key] = task
+        try:
+            result = await task
+        finally:
+            del _IN_FLIGHT[key]
+        # Cache before the database is updated, so a crash before the next flush replays this result
+        if result is not None:
+            store_analysis(key, result)
+        return result
+
+    print("  - Same PDF is already being analyzed. Waiting for that result.")
+    return await asyncio.shield(task)
+
+
+async def upload_file(client: httpx.AsyncClient, path: str, display_name: str, mime_type: str, api_key: str) -> str:
+    """Uploads the file at path with the Files API and returns the file's resource name.
+
+    The file is streamed from disk in chunks, so it never has to fit in memory.
+    """
+    size = os.path.getsize(path)
+
+    async def chunks():
+        with open(path, 'rb') as f:
+            while chunk := await asyncio.to_thread(f.read, UPLOAD_CHUNK_SIZE):
+                yield chunk
+
+    start = await client.post(
+        f"{GEMINI_API_BASE}/upload/v1beta/files?key={api_key}",
+        headers={
+            "X-Goog-Upload-Protocol": "resumable",
+            "X-Goog-Upload-Command": "start",
+            "X-Goog-Upload-Header-Content-Length": str(size),
+            "X-Goog-Upload-Header-Content-Type": mime_type,
+            "Content-Type": "application/json",
+        },
+        content=orjson.dumps({"file": {"display_name": display_name}}),
+        timeout=API_TIMEOUT,
+    )
+    start.raise_for_status()
+    upload = await client.post(
+        start.headers["x-goog-upload-url"],
+        headers={"X-Goog-Upload-Offset": "0", "X-Goog-Upload-Command": "upload, finalize",
+                 "Content-Length": str(size)},
+        content=chunks(),
+        timeout=API_TIMEOUT,
+    )
+    upload.raise_for_status()
+    return orjson.loads(upload.content)['file']['name']
+
+async def wait_for_batch_job(client: httpx.AsyncClient, batch_name: str, api_key: str) -> Dict[str, Any]:
+    """Checks the batch job every BATCH_POLL_INTERVAL seconds until it has finished and returns its final status.
+
+    A status check that fails transiently (network error, 429 or 5xx) is simply repeated at the
+    next interval, so an outage during a long job does not abandon it. Other HTTP errors, such
+    as a 404 for a job that no longer exists, raise httpx.HTTPStatusError.
+    """
+    while True:
+        await asyncio.sleep(BATCH_POLL_INTERVAL)
+        try:
+            response = await client.get(f"{GEMINI_API_BASE}/v1beta/{batch_name}?key={api_key}", timeout=API_TIMEOUT)
+        except httpx.TransportError as e:
+            print(f"Warning: Could not check batch job '{batch_name}' ({e!r}). Trying again later.", file=sys.stderr)
+            continue
+        if is_retryable(response):
+            print(f"Warning: Could not check batch job '{batch_name}' (HTTP {response.status_code}). Trying again later.", file=sys.stderr)
+            continue
+        response.raise_for_status()
+        status = orjson.loads(response.content)
+        if status.get('metadata', {}).get('state') in BATCH_END_STATES:
+            return status
+
+async def download_file(client: httpx.AsyncClient, file_name: str, api_key: str) -> bytes:
+    """Downloads a file produced by the API, retrying transient failures with exponential backoff."""
+    url = f"{GEMINI_API_BASE}/download/v1beta/{file_name}:download?alt=media&key={api_key}"
+    for attempt in range(MAX_RETRIES):
+        try:
+            response = await client.get(url, timeout=API_TIMEOUT)
+            if not is_retryable(response) or attempt == MAX_RETRIES - 1:
+                response.raise_for_status()
+                return response.content
+        except httpx.TransportError:
+            if attempt == MAX_RETRIES - 1:
+                raise
+        await asyncio.sleep(backoff_seconds(attempt))
+
+def batch_job_key(keys: List[str]) -> str:
+    """Cache key under which the name of a submitted, unfinished batch job for these analysis keys is kept."""
+    hasher = hashlib.blake2b(digest_size=16)
+    for key in sorted(keys):
+        hasher.update(key.encode('ascii'))
+    return f"batch:{hasher.hexdigest()}"
+
+async def write_batch_input(pdf_paths: Dict[str, str], prompt: str, path: str) -> int:
+    """Writes the Batch Mode input file (one JSON request per line) for the PDFs, keyed by analysis key.
+
+    PDFs are read and encoded one at a time, so only one of them is held in memory.
+    Returns the number of requests written; PDFs that cannot be read are left out.
+    """
+    written = 0
+    with open(path, 'wb') as jsonl:
+        for key, pdf_path in pdf_paths.items():
+            pdf_content = await read_pdf(pdf_path)
+            if not pdf_content: continue
+            line = orjson.dumps({"key": key, "request": build_analysis_payload(prompt, pdf_content)})
+            await asyncio.to_thread(jsonl.write, line + b"\n")
+            written += 1
+    return written
+
+async def run_batch_job(client: httpx.AsyncClient, pdf_paths: Dict[str, str], prompt: str, api_key: str) -> Dict[str, Dict[str, Any]]:
+    """Analyzes the PDFs, keyed by analysis key, in one Batch Mode job and returns the parsed analysis for each key.
+
+    Keys whose PDF could not be read, whose request failed, or whose answer could not be parsed, are left out.
+
+    The job's name is kept in the on-disk cache until its results have been collected, so a
+    run that is interrupted or fails while waiting is resumed by the next run over the same
+    PDFs instead of submitting (and paying for) the job again.
+    """
+    job_key = batch_job_key(list(pdf_paths))
+    batch_name = get_cache().get(job_key)
+    if batch_name is not None:
+        print(f"Resuming batch job '{batch_name}' submitted by an earlier run. Checking every {BATCH_POLL_INTERVAL}s...")
+    else:
+        # The requests are written to a temporary file and uploaded from there, so the encoded PDFs are never all in memory
+        fd, jsonl_path = tempfile.mkstemp(prefix='concart-batch-', suffix='.jsonl')
+        os.close(fd)
+        try:
+            if not await write_batch_input(pdf_paths, prompt, jsonl_path):
+                return {}
+            input_file = await upload_file(client, jsonl_path, "concart-analysis-batch", "application/jsonl", api_key)
+        finally:
+            os.remove(jsonl_path)
+
+        response = await client.post(
+            f"{GEMINI_API_BASE}/v1beta/models/{GEMINI_MODEL}:batchGenerateContent?key={api_key}",
+            headers={"Content-Type": "application/json"},
+            content=orjson.dumps({"batch": {"display_name": "concart-analysis-batch", "input_config": {"file_name": input_file}}}),
+            timeout=API_TIMEOUT,
+        )
+        response.raise_for_status()
+        batch_name = orjson.loads(response.content)['name']
+        get_cache().set(job_key, batch_name)
+        print(f"Submitted batch job '{batch_name}' for {len(pdf_paths)} PDFs. Checking every {BATCH_POLL_INTERVAL}s...")
+
+    try:
+        status = await wait_for_batch_job(client, batch_name, api_key)
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code < 500:
+            # The job cannot be checked any more (e.g. it was deleted), so do not resume it again
+            print(f"Error: Batch job '{batch_name}' can no longer be checked. The next run submits a new job.", file=sys.stderr)
+            get_cache().delete(job_key)
+        raise
+    state = status['metadata']['state']
+    if state != 'BATCH_STATE_SUCCEEDED':
+        print(f"Error: Batch job '{batch_name}' ended in state {state}", file=sys.stderr)
+        get_cache().delete(job_key)
+        return {}
+
+    responses_file = (status.get('response', {}).get('responsesFile')
+                      or status['metadata'].get('output', {}).get('responsesFile'))
+    if not responses_file:
+        print(f"Error: Batch job '{batch_name}' succeeded but its status names no responses file: {status}", file=sys.stderr)
+        get_cache().delete(job_key)
+        return {}
+    content = await download_file(client, responses_file, api_key)
+
+    results = {}
+    for line in content.splitlines():
+        if not line.strip():
+            continue
+        item = orjson.loads(line)
+        result_text = None
+        try:
+            result_text = item['response']['candidates'][0]['content']['parts'][0]['text']
+            results[item['key']] = parse_analysis_text(result_text)
+        except (json.JSONDecodeError, KeyError, IndexError) as e:
+            print(f"Error parsing batch response for '{item.get('key')}': {e}", file=sys.stderr)
+            print(f"Received: {result_text if result_text is not None else item.get('error')}", file=sys.stderr)
+    # The caller caches the results before anything else can run, so the job is no longer needed
+    get_cache().delete(job_key)
+    return results
+
+async def analyze_in_batch(client: httpx.AsyncClient, pdf_files: List[str], db: Dict[str, pd.DataFrame], api_key: str) -> Dict[str, Optional[Dict[str, Any]]]:
+    """Returns the analysis of each PDF, taken from the cache or from one Batch Mode job for the rest.
+
+    Every PDF in the job is analyzed with the same prompt, listing the objects in the database
+    before the run; objects introduced by other PDFs in the job are deduplicated by ObjectID only.
+    """
+    prompt = build_prompt(db['objects'], db['morphisms'])
+    keys = {}
+    analyses = {}
+    pending = {}
+    for pdf_path in pdf_files:
+        key = await asyncio.to_thread(analysis_key, pdf_path)
+        if not key: continue
+        if key not in analyses and key not in pending:
+            cached = cached_analysis(key)
+            if cached is not None:
+                analyses[key] = cached
+            else:
+                # Only PDFs without a cached analysis are read and encoded, when the job is submitted
+                pending[key] = pdf_path
+        keys[pdf_path] = key
 
-def update_database_files(data: Dict[str, Any], paths: Dict[str, str], citation_key: str):
-    """Reads, updates, and writes back the database CSV files."""
+    if pending:
+        for key, result in (await run_batch_job(client, pending, prompt, api_key)).items():
+            store_analysis(key, result)
+            analyses[key] = result
+    return {pdf_path: analyses.get(key) for pdf_path, key in keys.items()}
+
+def to_year(value: Any) -> Optional[int]:
+    """The year as an int, also when the model gave it as a string like "2024"; None if it is not a year."""
+    try:
+        return int(str(value).strip())
+    except (TypeError, ValueError):
+        return None
+
+def clean_row(row: Dict[str, Any], columns: List[str]) -> Dict[str, Any]:
+    """Keeps only the given columns of a row from the model, turning list or dict values into strings.
+
+    The model occasionally adds keys or returns lists; the tables only hold scalar values in known columns.
+    """
+    cleaned = {}
+    for column in columns:
+        value = row.get(column)
+        if isinstance(value, list):
+            value = ", ".join(str(item) for item in value)
+        elif isinstance(value, dict):
+            value = orjson.dumps(value).decode('utf-8')
+        cleaned[column] = value
+    return cleaned
+
+def append_to_buffers(data: Dict[str, Any], buffers: Dict[str, List[Dict[str, Any]]], citation_key: str,
+                      seen_objects: Set[str], seen_evidence: Set[tuple], evidence_ids: Dict[str, int]):
+    """Adds the new, non-duplicate rows from an analysis to the in-memory database.
+
+    New papers, objects and evidence are appended as dicts to the `buffers` lists and only
+    become part of the tables in the database when merge_buffers is called.
+
+    `seen_objects` holds every ObjectID in the database and is updated with the objects added here.
+    `seen_evidence` holds the (CitationKey, SourceID, MorphismID, TargetID) of every evidence
+    row in the database and is updated with the rows added here. `evidence_ids['next']` is the
+    EvidenceID to give the next new evidence row, and is advanced past the rows added here.
+    """
     try:
-        # 1. Update papers.csv
-        papers_df = pd.read_csv(paths['papers'])
+        # 1. Update papers
         bib_info = data.get('bibliographic', {})
 
         # FIX: Create a dictionary with keys that exactly match the columns
         # in the papers.csv file to prevent concatenation errors.
-        new_row_data = {
+        new_row_data = clean_row({
             'CitationKey': citation_key,
             'Authors': bib_info.get('authors'),
-            'Year': bib_info.get('year'),
             'Title': bib_info.get('title'),
             'Publication': bib_info.get('publication'),
-            'URL': pd.NA
-        }
+        }, ['CitationKey', 'Authors', 'Title', 'Publication'])
+        new_row_data['Year'] = to_year(bib_info.get('year'))
+        new_row_data['URL'] = pd.NA
         
-        # Create a new DataFrame from the single row dictionary
-        new_paper_df = pd.DataFrame([new_row_data])
-
-        # Concatenate the new row. Pandas will align columns by name
+        # Buffer the new row. When merged, pandas will align columns by name
         # and fill missing ones (like TheoryCategory) with NaN automatically.
-        papers_df = pd.concat([papers_df, new_paper_df], ignore_index=True)
-        
-        # Write back to CSV
-        papers_df.to_csv(paths['papers'], index=False)
+        buffers['papers'].append(new_row_data)
         print(f"  + Added '{citation_key}' to papers.csv")
 
-        # 2. Update c_objects.csv
-        objects_df = pd.read_csv(paths['objects'])
-        new_objects = data.get('new_objects', [])
-        if new_objects:
-            new_obj_df = pd.DataFrame(new_objects)
-            new_obj_df = new_obj_df[~new_obj_df['ObjectID'].isin(objects_df['ObjectID'])]
-            if not new_obj_df.empty:
-                objects_df = pd.concat([objects_df, new_obj_df], ignore_index=True)
-                objects_df.to_csv(paths['objects'], index=False)
-                for obj_id in new_obj_df['ObjectID']: print(f"  + Added '{obj_id}' to c_objects.csv")
+        # 2. Update objects
+        for obj in data.get('new_objects', []):
+            obj_id = obj.get('ObjectID')
+            if obj_id not in seen_objects:
+                seen_objects.add(obj_id)
+                buffers['objects'].append(clean_row(obj, list(DTYPES['objects'])))
+                print(f"  + Added '{obj_id}' to c_objects.csv")
         
-        # 3. Update c_evidence.csv
-        evidence_df = pd.read_csv(paths['evidence'])
+        # 3. Update evidence
         new_evidence = data.get('new_evidence', [])
-        if new_evidence:
-            for ev in new_evidence: ev['CitationKey'] = citation_key
-            new_ev_df = pd.DataFrame(new_evidence)
-            
-            # Create a unique key to prevent duplicates
-            new_ev_df['unique_key'] = new_ev_df['CitationKey'] + new_ev_df['SourceID'] + new_ev_df['MorphismID'] + new_ev_df['TargetID']
-            if not evidence_df.empty:
-                # Ensure unique_key column exists before trying to access it
-                if 'unique_key' not in evidence_df.columns:
-                    evidence_df['unique_key'] = evidence_df['CitationKey'] + evidence_df['SourceID'] + evidence_df['MorphismID'] + evidence_df['TargetID']
-                new_ev_df = new_ev_df[~new_ev_df['unique_key'].isin(evidence_df['unique_key'])]
+        # Keep only evidence whose key has not been seen, including earlier in this response
+        filtered = []
+        for ev in new_evidence:
+            key = (citation_key, ev.get('SourceID'), ev.get('MorphismID'), ev.get('TargetID'))
+            if key not in seen_evidence:
+                seen_evidence.add(key)
+                filtered.append(clean_row({**ev, 'CitationKey': citation_key}, list(DTYPES['evidence'])))
+
+        if filtered:
+            for evidence_id, ev in enumerate(filtered, start=evidence_ids['next']):
+                ev['EvidenceID'] = evidence_id
+            evidence_ids['next'] += len(filtered)
             
-            if not new_ev_df.empty:
-                next_id = (evidence_df['EvidenceID'].max() + 1) if not evidence_df.empty else 1
-                new_ev_df['EvidenceID'] = range(next_id, next_id + len(new_ev_df))
-                
-                final_evidence_df = pd.concat([evidence_df.drop(columns=['unique_key'], errors='ignore'), new_ev_df.drop(columns=['unique_key'])], ignore_index=True)
-                final_evidence_df.to_csv(paths['evidence'], index=False)
-                print(f"  + Added {len(new_ev_df)} new evidence entries to c_evidence.csv")
+            buffers['evidence'].extend(filtered)
+            print(f"  + Added {len(filtered)} new evidence entries to c_evidence.csv")
 
     except Exception as e:
         print(f"FATAL: Could not update database files. Error: {e}", file=sys.stderr)
 
+def merge_buffers(db: Dict[str, pd.DataFrame], buffers: Dict[str, List[Dict[str, Any]]], names: Optional[List[str]] = None):
+    """Concatenates the buffered new rows onto their database tables, once per table, and empties the buffers.
+
+    Only the tables in `names` are merged if it is given.
+    """
+    for name, rows in buffers.items():
+        if rows and (names is None or name in names):
+            db[name] = pd.concat([db[name], pd.DataFrame(rows)], ignore_index=True)
+            rows.clear()
+
+def save_database(db: Dict[str, pd.DataFrame], paths: Dict[str, str]) -> bool:
+    """Writes the in-memory papers, objects and evidence tables back to their files. Returns True on success."""
+    try:
+        for name in ('papers', 'objects', 'evidence'):
+            write_table(db[name], paths[name])
+        return True
+    except Exception as e:
+        print(f"FATAL: Could not write database files. Error: {e}", file=sys.stderr)
+        return False
+
+def migrate_to_parquet(paths: Dict[str, str]) -> Dict[str, str]:
+    """Writes a Parquet copy next to each CSV database file and returns the new paths.
+
+    The CSV files are left in place, as concart.jl still reads the database from CSV.
+    """
+    parquet_paths = {}
+    for name, path in paths.items():
+        parquet_path = path if is_parquet(path) else os.path.splitext(path)[0] + '.parquet'
+        if parquet_path != path:
+            write_table(read_table(path, DTYPES[name]), parquet_path)
+            print(f"  + Wrote '{parquet_path}'")
+        parquet_paths[name] = parquet_path
+    return parquet_paths
+
 # --- Main Execution ---
 
-def main():
-    parser = argparse.ArgumentParser(description='Analyze PDFs with Gemini and update a categorical database.')
-    parser.add_argument('--papers', required=True, help='Path to papers.csv')
-    parser.add_argument('--objects', required=True, help='Path to c_objects.csv')
-    parser.add_argument('--morphisms', required=True, help='Path to c_morphisms.csv')
-    parser.add_argument('--evidence', required=True, help='Path to c_evidence.csv')
-    args = parser.parse_args()
+async def process_pdfs(pdf_files: List[str], db: Dict[str, pd.DataFrame], paths: Dict[str, str], api_key: str,
+                       flush_every: int, batch: bool = False):
+    """Analyzes the PDFs and adds every new paper to the in-memory database.
 
-    paths = {"papers": args.papers, "objects": args.objects, "morphisms": args.morphisms, "evidence": args.evidence}
-    api_key = get_gemini_api_key()
-    
-    pdf_files = [line.strip() for line in sys.stdin if line.strip().lower().endswith('.pdf')]
-    if not pdf_files:
-        print("Error: No PDF files provided via stdin.", file=sys.stderr)
-        sys.exit(1)
+    PDFs are analyzed concurrently, or all in one Batch Mode job if `batch` is set.
 
-    try:
-        # Load all databases once at the start
-        papers_df = pd.read_csv(paths['papers'])
-        objects_df = pd.read_csv(paths['objects'])
-        morphisms_df = pd.read_csv(paths['morphisms'])
-    except FileNotFoundError as e:
-        print(f"Error: Could not find initial database file {e.filename}. Ensure paths are correct.", file=sys.stderr)
-        sys.exit(1)
-        
-    existing_citation_keys = set(papers_df['CitationKey'])
+    Database updates are serialized by a lock. New rows are buffered and merged into the
+    tables, which are then written, every `flush_every` new papers and once more on exit.
+    Buffered objects are also merged before a PDF's prompt is built, as the prompt lists them.
+    """
+    buffers = {'papers': [], 'objects': [], 'evidence': []}
 
-    for pdf_path in pdf_files:
-        if not os.path.exists(pdf_path):
-            print(f"Warning: Skipping non-existent file '{pdf_path}'", file=sys.stderr)
-            continue
-        
-        print(f"\n--- Processing: {os.path.basename(pdf_path)} ---")
+    # Write buffered updates every few papers, and once more on exit
+    unsaved_papers = 0
+    def flush():
+        nonlocal unsaved_papers
+        if unsaved_papers:
+            merge_buffers(db, buffers)
+            # Keep counting on failure, so the next flush (at the latest the one on exit) tries again
+            if save_database(db, paths):
+                unsaved_papers = 0
+    atexit.register(flush)
         
-        pdf_base64 = pdf_to_base64(pdf_path)
-        if not pdf_base64: continue
+    existing_citation_keys = set(db['papers']['CitationKey'])
+    seen_objects = set(db['objects']['ObjectID'])
+    evidence_df = db['evidence']
+    seen_evidence = set(zip(evidence_df['CitationKey'], evidence_df['SourceID'], evidence_df['MorphismID'], evidence_df['TargetID']))
+    evidence_ids = {'next': int(evidence_df['EvidenceID'].max()) + 1 if not evidence_df.empty else 1}
+
+    # A context cache holds one prompt, so with --cache-prompt the prompt is rendered once from the
+    # tables as loaded instead of after every new paper; new objects are still deduplicated by ObjectID
+    run_prompt = build_prompt(db['objects'], db['morphisms']) if CONTEXT_CACHING else None
+
+    pdf_slots = asyncio.Semaphore(MAX_CONCURRENT_PDFS)
+    # PDFs read ahead of a free slot, so reading overlaps with the requests in flight
+    prefetch_slots = asyncio.Semaphore(MAX_CONCURRENT_PDFS + PREFETCH_PDFS)
+    controller = ConcurrencyController(initial=MAX_CONCURRENT_PDFS, max_concurrency=MAX_CONCURRENT_PDFS)
+    db_lock = asyncio.Lock()
+
+    def record_analysis(pdf_path: str, extracted_data: Optional[Dict[str, Any]]):
+        nonlocal unsaved_papers
+        print(f"\n--- Processed: {os.path.basename(pdf_path)} ---")
 
-        # Perform the full analysis for every file. This is the only API call.
-        extracted_data = get_full_analysis(pdf_base64, objects_df, morphisms_df, api_key)
-        
         if not extracted_data:
             print(f"  - Analysis failed for '{pdf_path}'. Skipping.")
-            time.sleep(2) # API buffer
-            continue
+            return
 
         # Now, check if the paper already exists based on the analysis results.
         bib_info = extracted_data.get('bibliographic', {})
@@ -256,18 +855,130 @@ def main():
 
         if not citation_key:
             print(f"  - Could not generate a valid citation key from analysis results. Skipping.")
-            continue
+            return
 
         if citation_key in existing_citation_keys:
             print(f"  - Skipping '{citation_key}'. Already exists in database.")
         else:
-            # If it's a new paper, update all relevant files.
+            # If it's a new paper, update all relevant tables.
             print(f"  - New paper detected ('{citation_key}'). Updating database...")
-            update_database_files(extracted_data, paths, citation_key)
+            append_to_buffers(extracted_data, buffers, citation_key, seen_objects, seen_evidence, evidence_ids)
             # Add the new key to our set to prevent re-processing in this same run
             existing_citation_keys.add(citation_key)
-        
-        time.sleep(2) # API buffer
+            unsaved_papers += 1
+            if unsaved_papers >= flush_every:
+                flush()
+
+    async def process_one(client: httpx.AsyncClient, pdf_path: str):
+        async with prefetch_slots:
+            # Hashing and reading the PDF run off the event loop without blocking other requests
+            key = await asyncio.to_thread(analysis_key, pdf_path)
+            if not key: return
+            extracted_data = cached_analysis(key)
+            if extracted_data is not None:
+                print(f"  - Using cached analysis for '{os.path.basename(pdf_path)}'.")
+            else:
+                pdf_content = await read_pdf(pdf_path)
+                if not pdf_content: return
+
+                async with pdf_slots:
+                    prompt = run_prompt
+                    if prompt is None:
+                        # The prompt lists every object found so far, so merge the buffered ones first
+                        merge_buffers(db, buffers, ['objects'])
+                        prompt = build_prompt(db['objects'], db['morphisms'])
+                    # Perform the full analysis for every file. This is the only API call.
+                    extracted_data = await get_full_analysis(client, controller, key, pdf_content, prompt, api_key)
+
+        async with db_lock:
+            record_analysis(pdf_path, extracted_data)
+
+    # HTTP/2 multiplexes the concurrent requests over a few long-lived connections
+    limits = httpx.Limits(max_connections=10, max_keepalive_connections=10, keepalive_expiry=300)
+    async with httpx.AsyncClient(http2=True, limits=limits) as client:
+        if batch:
+            try:
+                analyses = await analyze_in_batch(client, pdf_files, db, api_key)
+            except httpx.HTTPError as e:
+                print(f"Error: Batch job failed: {e}. Run again to retry; a job that was submitted is resumed.", file=sys.stderr)
+                return
+            for pdf_path, extracted_data in analyses.items():
+                record_analysis(pdf_path, extracted_data)
+            return
+
+        try:
+            results = await asyncio.gather(*(process_one(client, pdf_path) for pdf_path in pdf_files), return_exceptions=True)
+        finally:
+            await delete_context_caches(client, api_key)
+
+    for pdf_path, result in zip(pdf_files, results):
+        if isinstance(result, Exception):
+            print(f"Error: Processing '{pdf_path}' failed: {result}", file=sys.stderr)
+
+def positive_int(value: str) -> int:
+    """argparse type for options that must be a whole number above zero."""
+    number = int(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"must be a positive integer, got {value}")
+    return number
+
+def main():
+    parser = argparse.ArgumentParser(description='Analyze PDFs with Gemini and update a categorical database.')
+    parser.add_argument('--papers', required=True, help='Path to papers.csv (or papers.parquet)')
+    parser.add_argument('--objects', required=True, help='Path to c_objects.csv (or c_objects.parquet)')
+    parser.add_argument('--morphisms', required=True, help='Path to c_morphisms.csv (or c_morphisms.parquet)')
+    parser.add_argument('--evidence', required=True, help='Path to c_evidence.csv (or c_evidence.parquet)')
+    parser.add_argument('--flush-every', type=int, default=10, help='Write the database files after this many new papers (default: 10)')
+    parser.add_argument('--batch', action='store_true', help='Analyze all uncached PDFs in one Gemini Batch Mode job (half price, may take hours)')
+    parser.add_argument('--cache-prompt', action='store_true', help="Store each prompt with Gemini's context caching instead of sending it with every PDF")
+    parser.add_argument('--rpm', type=positive_int, help='Send at most this many analysis requests per minute (default: no limit)')
+    parser.add_argument('--text-only', action='store_true', help='Send the text extracted with PyMuPDF instead of the PDF (smaller requests, but no figures)')
+    parser.add_argument('--no-cache', action='store_true', help='Neither use nor store cached analyses; always call the API')
+    parser.add_argument('--migrate-to-parquet', action='store_true', help='Write a .parquet copy of each CSV database file and exit')
+    args = parser.parse_args()
+
+    paths = {"papers": args.papers, "objects": args.objects, "morphisms": args.morphisms, "evidence": args.evidence}
+    global CACHE_ENABLED, CONTEXT_CACHING, TEXT_ONLY, RATE_LIMITER
+    CACHE_ENABLED = not args.no_cache
+    CONTEXT_CACHING = args.cache_prompt
+    TEXT_ONLY = args.text_only
+    if args.rpm is not None:
+        RATE_LIMITER = RateLimiter(args.rpm, 60)
+    if TEXT_ONLY and pymupdf is None:
+        print("Error: --text-only requires PyMuPDF (pip install pymupdf).", file=sys.stderr)
+        sys.exit(1)
+    if args.migrate_to_parquet:
+        try:
+            migrate_to_parquet(paths)
+        except FileNotFoundError as e:
+            print(f"Error: Could not find database file {e.filename}. Ensure paths are correct.", file=sys.stderr)
+            sys.exit(1)
+        return
+
+    api_key = get_gemini_api_key()
+    
+    pdf_files = [line.strip() for line in sys.stdin if line.strip().lower().endswith('.pdf')]
+    if not pdf_files:
+        print("Error: No PDF files provided via stdin.", file=sys.stderr)
+        sys.exit(1)
+
+    try:
+        # Load all databases once at the start; they are kept in memory and updated in place
+        db = {name: read_table(path, DTYPES[name]) for name, path in paths.items()}
+    except FileNotFoundError as e:
+        print(f"Error: Could not find initial database file {e.filename}. Ensure paths are correct.", file=sys.stderr)
+        sys.exit(1)
+
+    for pdf_path in pdf_files:
+        if not os.path.exists(pdf_path):
+            print(f"Warning: Skipping non-existent file '{pdf_path}'", file=sys.stderr)
+    pdf_files = [pdf_path for pdf_path in pdf_files if os.path.exists(pdf_path)]
+
+    try:
+        asyncio.run(process_pdfs(pdf_files, db, paths, api_key, args.flush_every, batch=args.batch))
+    finally:
+        if PROCESS_POOL is not None:
+            PROCESS_POOL.shutdown()
 
 if __name__ == "__main__":
     main()